@@ -0,0 +1,236 @@
+############################################
+## Topic:
+## Lazy evaluation and declarative approach
+##
+## Author:
+## Alexey Kachayev, <kachayev@gmail.com>
+##
+## Benchmarks for Stream (stream.py for Python 2.7+,
+## stream_33.py for Python 3.3+) compared to itertools.tee,
+## plain lists and lazy class from lazy_evaluation(_33).py
+##
+## Usage:
+## python bench_stream.py [-n SIZE] [-o results.jsonl] [--compare old.jsonl]
+##
+## Each result is one JSON object per line: bench, impl, python, n,
+## seconds (best of repeats) and peak_kb (Python 3.4+ only).
+############################################
+
+from __future__ import print_function, division
+
+import sys
+import json
+import random
+import argparse
+from timeit import default_timer
+from itertools import islice, tee, chain
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+PY2 = sys.version_info[0] == 2
+
+if PY2:
+    from itertools import imap as map
+    range = xrange
+    import stream
+else:
+    import stream_33 as stream
+
+import examples
+
+lazy = examples.lazy_evaluation().lazy
+Stream, WindowedStream = stream.Stream, stream.WindowedStream
+
+MOD = 2 ** 61 - 1 # keeps fib numbers small, we measure streams not bigints
+
+############################################
+## Cases: each one is a function of size
+## that runs full scenario once
+############################################
+
+def sequential(impl):
+    def stream_case(n):
+        for _ in Stream() << iter(range(n)): pass
+    def tee_case(n):
+        a, = tee(iter(range(n)), 1)
+        for _ in a: pass
+    def list_case(n):
+        for _ in list(iter(range(n))): pass
+    def lazy_case(n):
+        for _ in lazy(iter(range(n))): pass
+    return locals()[impl + "_case"]
+
+def indexing(impl):
+    def positions(n):
+        rnd = random.Random(42)
+        return [rnd.randrange(n) for _ in range(n // 10)]
+    def stream_case(n):
+        s = Stream() << iter(range(n))
+        for i in positions(n): s[i]
+    def list_case(n):
+        l = list(iter(range(n)))
+        for i in positions(n): l[i]
+    return locals().get(impl + "_case")
+
+def slicing(impl):
+    def bounds(n):
+        step = max(n // 100, 1)
+        return [(low, low + step) for low in range(0, n, step)]
+    def stream_case(n):
+        s = Stream() << iter(range(n))
+        for low, high in bounds(n): list(s[low:high])
+    def tee_case(n):
+        origin = iter(range(n))
+        for low, high in bounds(n):
+            origin, copy = tee(origin)
+            list(islice(copy, low, high))
+    def list_case(n):
+        l = list(iter(range(n)))
+        for low, high in bounds(n): l[low:high]
+    return locals().get(impl + "_case")
+
+def fib(impl):
+    def mod_add(a, b): return (a + b) % MOD
+    def stream_case(n):
+        f = Stream()
+        f << [0, 1] << map(mod_add, f, islice(f, 1, None))
+        f[n]
+    def windowed_case(n):
+        f = WindowedStream()
+        f << [0, 1] << map(mod_add, f, islice(f, 1, None))
+        f[n]
+    def tee_case(n):
+        def gen():
+            yield 0
+            yield 1
+            for x in map(mod_add, a, islice(b, 1, None)): yield x
+        a, b, out = tee(gen(), 3)
+        next(islice(out, n, None))
+    def list_case(n):
+        l = [0, 1]
+        for i in range(2, n + 1): l.append(mod_add(l[i - 2], l[i - 1]))
+        l[n]
+    return locals().get(impl + "_case")
+
+def cursors(impl, count=16):
+    def stream_case(n):
+        s = Stream() << iter(range(n))
+        its = [iter(s) for _ in range(count)]
+        for _ in range(n):
+            for it in its: next(it)
+    def tee_case(n):
+        its = tee(iter(range(n)), count)
+        for _ in range(n):
+            for it in its: next(it)
+    def list_case(n):
+        l = list(iter(range(n)))
+        for i in range(n):
+            for _ in range(count): l[i]
+    return locals().get(impl + "_case")
+
+def appends(impl, batch=10):
+    def batches(n):
+        return [list(range(i, min(i + batch, n))) for i in range(0, n, batch)]
+    def stream_case(n):
+        s = Stream()
+        for b in batches(n): s << iter(b)
+        for _ in s: pass
+    def tee_case(n):
+        a, = tee(chain.from_iterable(iter(b) for b in batches(n)), 1)
+        for _ in a: pass
+    def list_case(n):
+        l = []
+        for b in batches(n): l.extend(b)
+        for _ in l: pass
+    def lazy_case(n):
+        for _ in lazy(chain.from_iterable(iter(b) for b in batches(n))): pass
+    return locals().get(impl + "_case")
+
+BENCHES = [
+    ("sequential", sequential, ("stream", "tee", "list", "lazy")),
+    ("indexing", indexing, ("stream", "list")),
+    ("slicing", slicing, ("stream", "tee", "list")),
+    ("fib", fib, ("stream", "windowed", "tee", "list")),
+    ("cursors", cursors, ("stream", "tee", "list")),
+    ("appends", appends, ("stream", "tee", "list", "lazy")),
+]
+
+############################################
+## Runner
+############################################
+
+def measure(case, n, repeat):
+    best = None
+    for _ in range(repeat):
+        started = default_timer()
+        case(n)
+        elapsed = default_timer() - started
+        best = elapsed if best is None else min(best, elapsed)
+
+    peak = None
+    if tracemalloc is not None:
+        tracemalloc.start()
+        case(n)
+        peak = tracemalloc.get_traced_memory()[1] // 1024
+        tracemalloc.stop()
+    return best, peak
+
+def run(sizes, fib_sizes, repeat, only=None):
+    python = "%d.%d" % sys.version_info[:2]
+    for name, bench, impls in BENCHES:
+        if only and name not in only: continue
+        for n in (fib_sizes if name == "fib" else sizes):
+            for impl in impls:
+                seconds, peak = measure(bench(impl), n, repeat)
+                yield dict(bench=name, impl=impl, python=python, n=n,
+                           seconds=round(seconds, 6), peak_kb=peak)
+
+def key(result):
+    return result["bench"], result["impl"], result["python"], result["n"]
+
+def compare(results, baseline, threshold):
+    """Print results that are slower than baseline by more than threshold"""
+    old = dict((key(r), r) for r in baseline)
+    regressions = 0
+    for r in results:
+        prev = old.get(key(r))
+        if prev is None or not prev["seconds"]: continue
+        ratio = r["seconds"] / prev["seconds"]
+        if ratio > threshold:
+            regressions += 1
+            print("REGRESSION %s/%s python%s n=%d: %.6fs -> %.6fs (x%.2f)" % (
+                r["bench"], r["impl"], r["python"], r["n"], prev["seconds"], r["seconds"], ratio),
+                file=sys.stderr)
+    return regressions
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Stream benchmarks")
+    parser.add_argument("-n", type=int, action="append", help="size, could be repeated")
+    parser.add_argument("--fib", type=int, action="append", help="index for fib bench")
+    parser.add_argument("-r", "--repeat", type=int, default=3)
+    parser.add_argument("-b", "--bench", action="append", help="run only given benches")
+    parser.add_argument("-o", "--output", help="append JSON lines to file instead of stdout")
+    parser.add_argument("--compare", help="JSON lines from previous run")
+    parser.add_argument("--threshold", type=float, default=1.2)
+    args = parser.parse_args(argv)
+
+    sizes = args.n or [10 ** 4, 10 ** 5]
+    fib_sizes = args.fib or [10 ** 4, 10 ** 5, 10 ** 6]
+    out = open(args.output, "a") if args.output else sys.stdout
+    results = []
+    for result in run(sizes, fib_sizes, args.repeat, args.bench):
+        results.append(result)
+        out.write(json.dumps(result, sort_keys=True) + "\n")
+        out.flush()
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = [json.loads(line) for line in f if line.strip()]
+        return 1 if compare(results, baseline, args.threshold) else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,27 @@
+############################################
+## Topic:
+## Lazy evaluation and declarative approach
+##
+## Author:
+## Alexey Kachayev, <kachayev@gmail.com>
+##
+## Access to lazy_evaluation(_33).py from
+## other scripts (benchmarks, batch solver)
+############################################
+
+import sys
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+def lazy_evaluation():
+    """Module with lazy evaluation examples for running Python. Examples
+    print solutions on import, so stdout is muted meanwhile"""
+    name = "lazy_evaluation" if sys.version_info[0] == 2 else "lazy_evaluation_33"
+    stdout, sys.stdout = sys.stdout, StringIO()
+    try:
+        return __import__(name)
+    finally:
+        sys.stdout = stdout
@@ -17,8 +17,23 @@
 ############################################
 
 from functools import reduce
-from itertools import islice, chain, starmap
-from operator  import attrgetter as attr
+from itertools import islice, chain, starmap, repeat
+from operator  import attrgetter as attr, mul
+try:
+    from math import gcd
+except ImportError: # Python 3.3 and 3.4
+    from fractions import gcd
+from heapq import heappush, heappop, merge
+from array import array
+from collections import OrderedDict
+from multiprocessing import Process, Pipe, cpu_count
+from timeit import default_timer as timer
+import sys
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 ############################################
 ## Utils and helper functions
@@ -51,6 +66,55 @@ def foldr(l, r):
     """Helper function to switch from reduce to right folding"""
     return r(l)
 
+def lru(maxsize=16):
+    """Memoize function of hashable arguments, only maxsize most recently
+    used results are kept. Limit could be changed later with .maxsize
+    attribute, all results are dropped with .cache.clear()"""
+    def wrapper(fn):
+        cache = OrderedDict()
+        def inner(*args):
+            if args in cache:
+                cache.move_to_end(args)
+                return cache[args]
+            value = cache[args] = fn(*args)
+            while len(cache) > inner.maxsize:
+                cache.popitem(last=False)
+            return value
+        inner.maxsize, inner.cache = maxsize, cache
+        return inner
+    return wrapper
+
+class LayerStats:
+    """Counters for one BFS layer: depth of its states, size of frontier
+    it was expanded from, states generated by moves, duplicates dropped
+    (visited before or earlier in the same layer), fresh states, time
+    since previous layer and bytes of visited states with their parents"""
+
+    __slots__ = ("depth", "frontier", "generated", "duplicates", "fresh", "seconds", "visited_bytes")
+
+    def __init__(self, depth, frontier, generated, fresh, seconds, visited_bytes):
+        self.depth, self.frontier, self.generated = depth, frontier, generated
+        self.duplicates, self.fresh = generated - fresh, fresh
+        self.seconds, self.visited_bytes = seconds, visited_bytes
+
+    def __repr__(self):
+        return ("LayerStats(depth={0.depth}, frontier={0.frontier}, generated={0.generated}, "
+                "duplicates={0.duplicates}, fresh={0.fresh}, seconds={0.seconds:.6f}, "
+                "visited_bytes={0.visited_bytes})").format(self)
+
+def measured(layers, moves, visited_bytes, on_layer):
+    """Pass layers of (states, parent, move) through, reporting
+    LayerStats for each of them. Parent and move arrays of every layer
+    are kept to restore paths, so they are counted as visited too"""
+    frontier, depth, started = 1, 1, timer()
+    for layer in layers:
+        states, parent, move = layer
+        fresh = len(states)
+        visited_bytes += len(parent) * parent.itemsize + len(move) * move.itemsize
+        on_layer(LayerStats(depth, frontier, frontier * moves, fresh, timer() - started, visited_bytes))
+        yield layer
+        frontier, depth, started = fresh, depth + 1, timer()
+
 class lazy:
     def __init__(self, origin, state=None):
         self._origin = origin() if callable(origin) else origin
@@ -79,19 +143,19 @@ glasses  = range(len(capacity))
 ## description of all possible moves
 
 @named
-def empty(glass):
+def empty(glass, capacity=capacity):
     def inner(state):
         return update(state, (glass, 0))
     return inner 
 
 @named
-def fill(glass):
+def fill(glass, capacity=capacity):
     def inner(state):
         return update(state, (glass, capacity[glass]))
     return inner
 
 @named
-def pour(from_, to):
+def pour(from_, to, capacity=capacity):
     def inner(state):
         amount = min(state[from_], capacity[to]-state[to])
         return update(state, (from_, state[from_]-amount), (to, state[to]+amount))
@@ -151,21 +215,38 @@ print(dump_path(solution(6)))
 ## Solution based on class Path for history representation
 ##########################################################
 
-class Path(list):
-    _lead_to = None
+class Path:
+    """Persistent list of moves: each path keeps only last move and its
+    parent path, so extend is O(1) and shares whole history with parent.
+    End state is calculated once, with one move from parent's state."""
+
+    __slots__ = ("parent", "move", "lead_to", "_size")
+
+    def __init__(self, moves=(), start=initial):
+        root = Path.__new__(Path)
+        root.parent, root.move, root.lead_to, root._size = None, None, tuple(start), 0
+        path = reduce(Path.extend, moves, root)
+        self.parent, self.move, self.lead_to, self._size = path.parent, path.move, path.lead_to, path._size
 
-    @property
-    def lead_to(self):
-        if not self._lead_to:
-            self._lead_to = tuple(reduce(foldr, self, initial))
-        return self._lead_to
+    def __len__(self):
+        return self._size
+
+    def __iter__(self):
+        moves, path = [], self
+        while path.parent is not None:
+            moves.append(path.move)
+            path = path.parent
+        return reversed(moves)
 
     def __str__(self):
         path = ", ".join(map(attr("__name__"), self))
         return "{path} ==> {end}".format(path = path, end = self.lead_to)
 
-    def extend(self, move):
-        return Path(self + [move])
+    def extend(self, move, lead_to=None):
+        path = Path.__new__(Path)
+        path.parent, path.move, path._size = self, move, self._size + 1
+        path.lead_to = tuple(move(self.lead_to)) if lead_to is None else lead_to
+        return path
 
 ## check that Path abstraction works as we expect
 assert Path([fill(0), fill(1)]).lead_to == (4, 9)
@@ -174,6 +255,12 @@ assert Path([fill(0), empty(0)]).lead_to == (0, 0)
 assert Path([fill(0), pour(0, 1)]).lead_to == (0, 4)
 assert Path([fill(0), empty(0), fill(1)]).lead_to == (0, 9)
 
+## extended path shares history with its parent
+p = Path([fill(0)])
+assert p.extend(pour(0, 1)).parent is p
+assert len(p.extend(pour(0, 1))) == 2
+assert str(p.extend(pour(0, 1))) == "fill(0), pour(0, 1) ==> (0, 4)"
+
 def started_at(path_sets, explored):
     more = lazy(filter(
         lambda p: p.lead_to not in explored,
@@ -198,3 +285,549 @@ assert len(solution(1)) == 5
 print(solution(7))
 # output:
 # fill(0), pour(0, 1), fill(0), pour(0, 1), fill(0), pour(0, 1), empty(1), pour(0, 1), fill(0), pour(0, 1) ==> (0, 7)
+
+##########################################################
+## Solution based on graph of states
+##########################################################
+
+## path is enumerated only once for each state: we keep parent pointer
+## (previous state and move) for every visited state, each move is
+## applied once to the state of its parent and whole path is restored
+## only when it's requested
+
+def move_args(capacity):
+    glasses = range(len(capacity))
+    singles = [(move, (g,)) for move in (empty, fill) for g in glasses]
+    return singles + [(pour, (f, t)) for f in glasses for t in glasses if f != t]
+
+def all_moves(capacity):
+    return [move(*args, capacity=capacity) for move, args in move_args(capacity)]
+
+def traverse(capacity, parents, on_layer=None):
+    """Breadth-first traversal of states reachable from empty glasses,
+    each state is yielded once in order of distance, parents dict is
+    filled with state -> (previous state, move). on_layer is called
+    with LayerStats when layer is finished"""
+    moves = all_moves(capacity)
+    start = tuple([0] * len(capacity))
+    parents[start] = None
+    frontier, depth = [start], 1
+    while frontier:
+        layer, started = [], timer()
+        for state in frontier:
+            for move in moves:
+                child = tuple(move(state))
+                if child not in parents:
+                    parents[child] = (state, move)
+                    layer.append(child)
+                    yield child
+        if on_layer is not None:
+            # dict itself and approximate size of its keys and values
+            entry = sys.getsizeof(start) + sys.getsizeof((start, None))
+            on_layer(LayerStats(depth, len(frontier), len(frontier) * len(moves), len(layer),
+                                timer() - started, sys.getsizeof(parents) + len(parents) * entry))
+        frontier, depth = layer, depth + 1
+
+def path_to(parents, state):
+    steps = []
+    while parents[state] is not None:
+        previous, move = parents[state]
+        steps.append((move, state))
+        state = previous
+    path = Path(start=state)
+    for move, end in reversed(steps):
+        path = path.extend(move, end)
+    return path
+
+## amount should fit into biggest glass and be multiple of gcd of
+## capacities, other targets are rejected before any search
+def measurable(target, capacity):
+    return 0 <= target <= max(capacity) and target % reduce(gcd, capacity) == 0
+
+## shortest path for each state with target in one of glasses
+def bfs(target, capacity, on_layer=None):
+    parents = {}
+    states = traverse(capacity, parents, on_layer)
+    return (path_to(parents, state) for state in states if target in state)
+
+## engine is function of (target, capacity, on_layer) giving shortest
+## paths to states with target in order of distance, sections below
+## add their own engines by name of mode
+engines = {"bfs": bfs}
+
+def solutions(target, capacity=capacity, mode="bfs", on_layer=None):
+    if not measurable(target, capacity):
+        return lazy(iter([]))
+    return lazy(engines[mode](target, capacity, on_layer))
+
+def solution(target, capacity=capacity, mode="bfs", on_layer=None):
+    return next(solutions(target, capacity, mode, on_layer))
+
+## same shortest solutions as with paths enumeration
+assert str(solution(6)) == "fill(1), pour(1, 0), empty(0), pour(1, 0), empty(0), pour(1, 0), fill(1), pour(1, 0) ==> (4, 6)"
+assert str(solution(7)) == "fill(0), pour(0, 1), fill(0), pour(0, 1), fill(0), pour(0, 1), empty(1), pour(0, 1), fill(0), pour(0, 1) ==> (0, 7)"
+assert [len(p) for p in solutions(1)] == [4, 5, 6, 7]
+
+## ...and it works for any number and sizes of glasses
+assert solution(4, capacity=(3, 5, 8)).lead_to == (3, 4, 0)
+assert len(solution(4, capacity=(3, 5, 8))) == 6
+assert len(solution(1, capacity=(9973, 10007))) == 3524
+
+##########################################################
+## Informed search
+##########################################################
+
+## A* over the same graph of states. Heuristic is lower bound of moves
+## left: 0 when target is already in one of glasses, 1 when it could be
+## measured with one move and 2 otherwise. Ties are broken by rank of
+## parent (in order of expansion) and move, so each entry of the heap is
+## a few integers, and paths are as short as with BFS, though paths of
+## the same length could come in different order.
+##
+## Bound is never more than 2, so A* expands almost the same states as
+## BFS (7049 against 7050 for target 1 and (9973, 10007)) and heap makes
+## it slower. It's not a speedup for big capacities: what saves work is
+## rejecting targets that can't be measured, and it's done for all modes.
+## That's why it's not registered as a mode, astar() is here to compare.
+
+def lower_bound(capacity, target):
+    pairs = [(f, t) for f in range(len(capacity)) for t in range(len(capacity)) if f != t]
+    def h(state):
+        if target in state: return 0
+        if target in capacity: return 1
+        for f, t in pairs:
+            amount = min(state[f], capacity[t]-state[t])
+            if state[f]-amount == target or state[t]+amount == target: return 1
+        return 2
+    return h
+
+def search(capacity, target, parents):
+    """A* traversal, yields states with target in order of distance,
+    parents dict is filled with state -> (previous state, move)"""
+    moves, h = all_moves(capacity), lower_bound(capacity, target)
+    start = tuple([0] * len(capacity))
+    # key is (depth, rank of parent, move), None when state is closed
+    parents[start], best = None, {start: (0, 0, 0)}
+    opened, expanded = [(h(start), 0, 0, 0, start)], 0
+    while opened:
+        _, depth, rank, step, state = heappop(opened)
+        if best[state] != (depth, rank, step): continue # better one was found
+        best[state], depth, rank = None, depth + 1, expanded
+        expanded += 1
+        if target in state and state != start: yield state
+        for step, move in enumerate(moves):
+            child = tuple(move(state))
+            known = best.get(child, ())
+            if known is None or known and known <= (depth, rank, step): continue
+            best[child], parents[child] = (depth, rank, step), (state, move)
+            heappush(opened, (depth + h(child), depth, rank, step, child))
+
+def astar(target, capacity, on_layer=None):
+    if not measurable(target, capacity):
+        return iter([])
+    parents = {}
+    return (path_to(parents, state) for state in search(capacity, target, parents))
+
+## paths as short as with BFS
+for sizes in [(4, 9), (3, 5, 8), (6, 10, 15), (97, 101)]:
+    for target in range(20):
+        found = [len(p) for p in islice(astar(target, sizes), 5)]
+        assert found == [len(p) for p in islice(solutions(target, sizes), 5)]
+
+## no search at all when target can't be measured
+assert list(astar(3, capacity=(4, 8))) == []
+assert list(solutions(10, capacity=(4, 9))) == []
+
+##########################################################
+## Reachability table
+##########################################################
+
+## one pass over all states reachable for given capacity collects first
+## (closest) state for every amount, so each solution is only restoring
+## of path by parent pointers. Tables are cached by capacity.
+##
+## Table is opt-in (mode="table"): building it is a pass over the whole
+## reachable space, which pays off for many queries on the same capacity.
+## One-off query with BFS stops at the first layer with target, on big
+## capacities that is much less work and memory.
+
+@lru(maxsize=16)
+def reachable(capacity):
+    """Parents of all reachable states and dict amount -> closest state
+    with this amount in one of glasses"""
+    parents, closest = {}, {}
+    for state in traverse(capacity, parents):
+        for amount in state:
+            closest.setdefault(amount, state)
+    return parents, closest
+
+def all_solutions(capacity=capacity):
+    """Shortest solution for every amount that could be measured"""
+    parents, closest = reachable(capacity)
+    return dict((amount, path_to(parents, state)) for amount, state in closest.items())
+
+def table(target, capacity, on_layer=None):
+    """Only the closest solution is kept in table"""
+    parents, closest = reachable(capacity)
+    if target in closest:
+        yield path_to(parents, closest[target])
+
+engines["table"] = table
+
+## same solutions as with BFS
+for sizes in [(4, 9), (3, 5, 8), (6, 10, 15)]:
+    for target in range(20):
+        if measurable(target, sizes):
+            assert str(solution(target, sizes, "table")) == str(solution(target, sizes))
+assert sorted(all_solutions()) == list(range(10))
+assert str(all_solutions()[6]) == str(solution(6))
+
+## table is built once for capacity, least recently used one is dropped
+assert reachable((4, 9)) is reachable((4, 9))
+reachable.maxsize = 2
+reachable.cache.clear()
+solution(4, (3, 5, 8), "table")
+solution(1, (6, 10, 15), "table")
+solution(2, (3, 5, 8), "table")
+solution(1, mode="table")
+assert list(reachable.cache) == [((3, 5, 8),), ((4, 9),)]
+
+##########################################################
+## Compact states
+##########################################################
+
+## state is packed into single integer using mixed radix over capacity,
+## visited states are bits of preallocated bytearray, updated in place.
+## For each BFS layer only arrays of codes, parent indexes and move
+## indexes are kept, so memory is a few bytes per state instead of
+## tuple and dict entry.
+
+def radix(capacity):
+    return [reduce(mul, [c + 1 for c in capacity[:i]], 1) for i in range(len(capacity))]
+
+def encode(state, capacity):
+    return sum(n * w for n, w in zip(state, radix(capacity)))
+
+def decode(code, capacity):
+    state = []
+    for c in capacity:
+        code, n = divmod(code, c + 1)
+        state.append(n)
+    return tuple(state)
+
+def bitset_size(capacity):
+    """Bytes of bitset for all states of capacity"""
+    return (reduce(mul, [c + 1 for c in capacity]) + 7) // 8
+
+def bitset(capacity):
+    """Empty set of visited states, with initial state in it"""
+    visited = bytearray(bitset_size(capacity))
+    visited[0] = 1
+    return visited
+
+def coded(capacity):
+    """Functions of encoded state, in the same order as all_moves"""
+    weights = radix(capacity)
+    def level(code, g):
+        return code // weights[g] % (capacity[g] + 1)
+    def empty_(g):
+        return lambda code: code - level(code, g) * weights[g]
+    def fill_(g):
+        return lambda code: code + (capacity[g] - level(code, g)) * weights[g]
+    def pour_(f, t):
+        def inner(code):
+            amount = min(level(code, f), capacity[t] - level(code, t))
+            return code + amount * (weights[t] - weights[f])
+        return inner
+    factories = {empty: empty_, fill: fill_, pour: pour_}
+    return [factories[move](*args) for move, args in move_args(capacity)]
+
+def compact_layers(capacity):
+    """BFS by layers: yields arrays of codes of new states, index of
+    parent in previous layer and index of move for each of them"""
+    moves, visited = coded(capacity), bitset(capacity)
+    frontier = array("q", [0])
+    while frontier:
+        codes, parent, move = array("q"), array("I"), array("H")
+        for p, code in enumerate(frontier):
+            for m, apply in enumerate(moves):
+                child = apply(code)
+                if not visited[child >> 3] & (1 << (child & 7)):
+                    visited[child >> 3] |= 1 << (child & 7)
+                    codes.append(child)
+                    parent.append(p)
+                    move.append(m)
+        yield codes, parent, move
+        frontier = codes
+
+def layered_solutions(capacity, layers, found):
+    """Paths to states with target from layers of (states, parent, move),
+    found(states) gives indexes and tuples of states with target"""
+    moves, history = all_moves(capacity), []
+    for states, parent, move in layers:
+        history.append((parent, move))
+        for index, _ in found(states):
+            steps, i = [], index
+            for parent, move in reversed(history):
+                steps.append(moves[move[i]])
+                i = parent[i]
+            yield Path(reversed(steps), start=tuple([0] * len(capacity)))
+
+def codes_with(target, capacity):
+    """Indexes and states with target for array of codes"""
+    def found(codes):
+        states = (decode(code, capacity) for code in codes)
+        return ((i, state) for i, state in enumerate(states) if target in state)
+    return found
+
+def layered(source, found):
+    """Engine for BFS by layers: source(capacity) gives layers of
+    (states, parent, move), found(target, capacity) picks states with
+    target in each of them"""
+    def instrumented(capacity, on_layer=None):
+        layers = source(capacity)
+        if on_layer is None: return layers
+        return measured(layers, len(all_moves(capacity)), bitset_size(capacity), on_layer)
+    def engine(target, capacity, on_layer=None):
+        return layered_solutions(capacity, instrumented(capacity, on_layer), found(target, capacity))
+    engine.layers = instrumented
+    return engine
+
+engines["compact"] = layered(compact_layers, codes_with)
+
+assert decode(encode((3, 0, 7), (3, 5, 8)), (3, 5, 8)) == (3, 0, 7)
+assert encode((3, 5, 8), (3, 5, 8)) == 4 * 6 * 9 - 1
+assert len(bitset((13, 37, 71, 89))) == 14 * 38 * 72 * 90 // 8
+
+## same solutions as with BFS
+for sizes in [(4, 9), (3, 5, 8), (6, 10, 15), (97, 101)]:
+    for target in range(20):
+        if measurable(target, sizes):
+            assert str(solution(target, sizes, "compact")) == str(solution(target, sizes))
+assert [len(p) for p in solutions(1, mode="compact")] == [4, 5, 6, 7]
+assert len(solution(1, (9973, 10007), "compact")) == 3524
+
+##########################################################
+## Vectorized frontier
+##########################################################
+
+## whole BFS layer is an integer array (states x glasses), each move is
+## applied to all states at once. States are encoded into integers to
+## drop duplicates with np.unique, visited ones are checked and marked
+## in the same bitset as for compact states. Order of new states in
+## layer is the same as with traverse(), so are the solutions. Without
+## NumPy "numpy" mode falls back to plain BFS.
+
+def vectorized(capacity):
+    """Functions of layer array, in the same order as all_moves"""
+    capacity = np.array(capacity)
+    def empty_(g):
+        def inner(layer): layer[:, g] = 0
+        return inner
+    def fill_(g):
+        def inner(layer): layer[:, g] = capacity[g]
+        return inner
+    def pour_(f, t):
+        def inner(layer):
+            amount = np.minimum(layer[:, f], capacity[t] - layer[:, t])
+            layer[:, f] -= amount
+            layer[:, t] += amount
+        return inner
+    factories = {empty: empty_, fill: fill_, pour: pour_}
+    return [factories[move](*args) for move, args in move_args(capacity)]
+
+def layers(capacity):
+    """BFS by layers: yields arrays of new states, index of parent in
+    previous layer and index of move for each of them"""
+    moves, weights = vectorized(capacity), np.array(radix(capacity))
+    visited = np.frombuffer(bitset(capacity), dtype=np.uint8)
+    frontier = np.zeros((1, len(capacity)), dtype=np.int64)
+    while len(frontier):
+        children = np.repeat(frontier[:, np.newaxis, :], len(moves), axis=1)
+        for i, move in enumerate(moves):
+            move(children[:, i, :])
+        children = children.reshape(-1, len(capacity))
+        codes = children.dot(weights)
+        _, first = np.unique(codes, return_index=True)
+        first.sort()
+        fresh = first[(visited[codes[first] >> 3] >> (codes[first] & 7)) & 1 == 0]
+        np.bitwise_or.at(visited, codes[fresh] >> 3, (1 << (codes[fresh] & 7)).astype(np.uint8))
+        frontier = children[fresh]
+        yield frontier, fresh // len(moves), fresh % len(moves)
+
+def arrays_with(target, capacity):
+    """Indexes and states with target for layer array"""
+    def found(states):
+        indexes = np.nonzero((states == target).any(axis=1))[0]
+        return ((i, tuple(int(n) for n in states[i])) for i in indexes)
+    return found
+
+engines["numpy"] = layered(layers, arrays_with) if np is not None else bfs
+
+if np is not None:
+    ## same solutions as with BFS
+    for sizes in [(4, 9), (3, 5, 8), (6, 10, 15), (97, 101)]:
+        for target in range(20):
+            if measurable(target, sizes):
+                assert str(solution(target, sizes, "numpy")) == str(solution(target, sizes))
+    assert [len(p) for p in solutions(1, mode="numpy")] == [4, 5, 6, 7]
+    assert str(solution(1, (13, 37, 71, 89), "numpy")) == str(solution(1, (13, 37, 71, 89), "bfs"))
+    assert len(solution(1, (9973, 10007), "numpy")) == 3524
+
+##########################################################
+## Sharded frontier
+##########################################################
+
+## each BFS layer is expanded by several processes. States are split
+## between workers by code % workers, and every worker owns bitset of
+## visited states and part of frontier only for its own shard. Worker
+## expands its part of frontier, children are routed to their owners,
+## owners drop visited ones. Candidate's rank is position of parent in
+## frontier * number of moves + index of move, so new states ordered by
+## rank (with the smallest rank kept for duplicates) come exactly in the
+## order of traverse(). Each part of candidates and of new states is
+## already sorted by rank, so they are only merged, main process passes
+## arrays between workers and merges new states of the layer.
+
+def shard_worker(capacity, workers, conn):
+    moves = coded(capacity)
+    visited = bytearray(reduce(mul, [c + 1 for c in capacity]) // workers // 8 + 1)
+    frontier = array("q") # own states of the last layer, ordered by rank
+    while True:
+        message = conn.recv()
+        if message is None: return
+        command, payload = message
+        if command == "expand":
+            # positions of frontier states are increasing,
+            # so are ranks of children routed to each owner
+            routed = [(array("q"), array("q")) for _ in range(workers)]
+            for position, code in zip(payload, frontier):
+                for m, apply in enumerate(moves):
+                    child = apply(code)
+                    ranks, codes = routed[child % workers]
+                    ranks.append(position * len(moves) + m)
+                    codes.append(child)
+            conn.send(routed)
+        else:
+            ranks, frontier = array("q"), array("q")
+            # parts are sorted runs, so sorting is only merging them
+            for rank, code in sorted(chain.from_iterable(zip(*part) for part in payload)):
+                local = code // workers
+                if not visited[local >> 3] & (1 << (local & 7)):
+                    visited[local >> 3] |= 1 << (local & 7)
+                    ranks.append(rank)
+                    frontier.append(code)
+            conn.send((ranks, frontier))
+
+def sharded_layers(capacity, workers=None):
+    """Same layers as compact_layers(), calculated by pool of processes"""
+    workers, size = workers or cpu_count(), len(all_moves(capacity))
+    pipes = [Pipe() for _ in range(workers)]
+    pool = [Process(target=shard_worker, args=(capacity, workers, child)) for _, child in pipes]
+    conns = [conn for conn, _ in pipes]
+    for process in pool:
+        process.daemon = True
+        process.start()
+    try:
+        conns[0].send(("visit", [(array("q", [0]), array("q", [0]))]))
+        conns[0].recv()
+        positions = [array("q", [0])] + [array("q") for _ in conns[1:]]
+        while True:
+            for conn, owned in zip(conns, positions):
+                conn.send(("expand", owned))
+            routed = [conn.recv() for conn in conns]
+            for owner, conn in enumerate(conns):
+                conn.send(("visit", [parts[owner] for parts in routed]))
+            fresh = [conn.recv() for conn in conns]
+            runs = [zip(ranks, repeat(w), codes) for w, (ranks, codes) in enumerate(fresh)]
+            layer, parent, move = array("q"), array("I"), array("H")
+            positions = [array("q") for _ in conns]
+            for position, (rank, w, code) in enumerate(merge(*runs)):
+                layer.append(code)
+                parent.append(rank // size)
+                move.append(rank % size)
+                positions[w].append(position)
+            yield layer, parent, move
+            if not layer: return
+    finally:
+        for conn in conns: conn.send(None)
+        for process in pool: process.join()
+
+engines["parallel"] = layered(sharded_layers, codes_with)
+
+##########################################################
+## POUR1: two vessels, closed form
+##########################################################
+
+## for two vessels the shortest solution is one of two simulations:
+## always pour from a to b or the same from b to a, and number of steps
+## is known without simulation (see pour1.py, batch solver). Here this
+## closed form is checked against BFS over states.
+
+from pour1 import min_steps, pour1
+
+def verify(a, b, c):
+    """Same answer with BFS over states"""
+    if c == 0: return 0
+    try:
+        return len(solution(c, (a, b), "compact"))
+    except StopIteration:
+        return -1
+
+assert list(pour1(iter([2, 5, 2, 3, 2, 3, 4]))) == [2, -1]
+assert min_steps(4, 9, 7) == len(solution(7)) == 10
+for a in range(1, 12):
+    for b in range(1, 12):
+        for c in range(1, 13):
+            assert min_steps(a, b, c) == verify(a, b, c)
+assert min_steps(9973, 10007, 1) == verify(9973, 10007, 1)
+
+##########################################################
+## Search instrumentation
+##########################################################
+
+## every layer-by-layer mode reports LayerStats to on_layer callback:
+## solution(target, capacity, mode, on_layer=print) or profile() for
+## the whole reachable space. Table is built once per capacity, so it's
+## not instrumented.
+
+def profile(capacity=capacity, mode="bfs"):
+    """LayerStats for traversal of all states reachable for capacity"""
+    report = []
+    if mode == "bfs":
+        for _ in traverse(capacity, {}, report.append): pass
+    else:
+        for _ in engines[mode].layers(capacity, report.append): pass
+    return report
+
+stats = profile((4, 9))
+assert [s.depth for s in stats] == list(range(1, len(stats) + 1))
+assert sum(s.fresh for s in stats) == len(reachable((4, 9))[0]) - 1
+assert all(s.generated == s.frontier * 6 == s.duplicates + s.fresh for s in stats)
+assert stats[0].frontier == 1 and stats[-1].fresh == 0
+
+for sizes in [(4, 9), (3, 5, 8)]:
+    fresh = [s.fresh for s in profile(sizes)]
+    assert [s.fresh for s in profile(sizes, "compact")] == fresh
+    if np is not None:
+        assert [s.fresh for s in profile(sizes, "numpy")] == fresh
+
+reported = []
+solution(7, mode="compact", on_layer=reported.append)
+assert len(reported) == len(solution(7)) # stops at the layer with solution
+history = 4 + 2 # parent and move of each state
+assert reported[0].visited_bytes == bitset_size(capacity) + history * reported[0].fresh
+assert reported[-1].visited_bytes == bitset_size(capacity) + history * sum(s.fresh for s in reported)
+
+## worker processes could re-import this module, so they
+## are started only when it's executed as script
+if __name__ == "__main__":
+    ## same solutions as with BFS, for any number of workers
+    for sizes in [(4, 9), (3, 5, 8), (6, 10, 15), (13, 37, 71)]:
+        expected = [list(map(list, layer)) for layer in compact_layers(sizes)]
+        for workers in (1, 3):
+            assert [list(map(list, layer)) for layer in sharded_layers(sizes, workers)] == expected
+        for target in (1, 2, 4):
+            assert str(solution(target, sizes, "parallel")) == str(solution(target, sizes, "compact"))
+    assert str(solution(1, (13, 37, 71, 89), "parallel")) == str(solution(1, (13, 37, 71, 89), "bfs"))
+    assert [s.fresh for s in profile((3, 5, 8), "parallel")] == [s.fresh for s in profile((3, 5, 8))]
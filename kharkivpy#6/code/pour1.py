@@ -0,0 +1,127 @@
+############################################
+## Topic:
+## Lazy evaluation and declarative approach
+## to pathfinding algorithms implementation
+##
+## Author:
+## Alexey Kachayev, <kachayev@gmail.com>
+##
+## Batch solver for "Pouring water problem",
+## http://www.codechef.com/problems/POUR1
+## closed form for two vessels, checked against
+## BFS from lazy_evaluation(_33).py
+##
+## Usage:
+## python pour1.py [input] [-o output] [--verify]
+##
+## Test cases are read from file (or stdin) and answers are written
+## as soon as they are calculated. With --verify each answer is checked
+## with BFS over states, mismatches are reported to stderr.
+############################################
+
+from __future__ import print_function
+
+import sys
+import argparse
+from itertools import islice
+
+try:
+    from math import gcd
+except ImportError:
+    from fractions import gcd
+
+## for two vessels the shortest solution is one of two simulations:
+## always pour from a to b (fill a when it's empty, empty b when it's
+## full) or the same from b to a. Simulation stops right after a pour,
+## when cumulative amount poured t is a multiple of a or b, so number of
+## fills, empties and pours is known for t and only the first suitable
+## t is needed: solution of congruence, O(log) instead of O(a + b).
+
+def inverse(x, m):
+    """Inverse of x modulo m (x and m are coprime)"""
+    r0, r1, s0, s1 = m, x % m, 0, 1
+    while r1:
+        q = r0 // r1
+        r0, r1, s0, s1 = r1, r0 - q * r1, s1, s0 - q * s1
+    return s0 % m
+
+def pouring(a, b, c):
+    """Steps to measure c by pouring only from a to b"""
+    if c == a: return 1
+    g = gcd(a, b)
+    ends = [b] if c == b else []
+    if c < b: # c in b right after a is emptied
+        ends.append(((c // g) * inverse(a // g, b // g) % (b // g) or b // g) * a)
+    if c < a: # c left in a right after b is filled
+        ends.append(((-c // g) * inverse(b // g, a // g) % (a // g) or a // g) * b)
+    t = min(ends)
+    fills, empties = -(-t // a), (t - 1) // b
+    pours = t // a + t // b - t // (a // g * b)
+    return fills + empties + pours
+
+def min_steps(a, b, c):
+    """Answer for POUR1 test case, -1 when c can't be measured"""
+    if c == 0: return 0
+    if c > max(a, b) or c % gcd(a, b): return -1
+    return min(pouring(a, b, c), pouring(b, a, c))
+
+def cases(numbers):
+    """Test cases (a, b, c) from POUR1 input given as iterator of numbers:
+    number of test cases followed by a, b, c for each of them"""
+    total = next(numbers, 0)
+    for i in range(total):
+        case = tuple(islice(numbers, 3))
+        if len(case) < 3:
+            raise ValueError("input is truncated: %d test cases expected, %d found" % (total, i))
+        yield case
+
+def pour1(numbers, answer=min_steps):
+    """Answers for POUR1 input given as iterator of numbers"""
+    for a, b, c in cases(numbers):
+        yield answer(a, b, c)
+
+def numbers(lines):
+    for line in lines:
+        for token in line.split():
+            yield int(token)
+
+assert list(pour1(iter([2, 5, 2, 3, 2, 3, 4]))) == [2, -1]
+assert list(pour1(iter([]))) == []
+try:
+    list(pour1(iter([2, 5, 2, 3, 2])))
+except ValueError:
+    pass
+else:
+    assert False, "ValueError expected"
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="POUR1 batch solver")
+    parser.add_argument("input", nargs="?", help="file with test cases, stdin by default")
+    parser.add_argument("-o", "--output", help="write answers to file instead of stdout")
+    parser.add_argument("--verify", action="store_true", help="check answers with BFS")
+    args = parser.parse_args(argv)
+
+    source = open(args.input) if args.input else sys.stdin
+    out = open(args.output, "w") if args.output else sys.stdout
+    mismatches = []
+    def checked(a, b, c):
+        steps = min_steps(a, b, c)
+        if steps != solver.verify(a, b, c):
+            mismatches.append((a, b, c))
+            print("MISMATCH a=%d b=%d c=%d: %d" % (a, b, c, steps), file=sys.stderr)
+        return steps
+
+    if args.verify:
+        import examples
+        solver = examples.lazy_evaluation()
+    try:
+        for steps in pour1(numbers(source), checked if args.verify else min_steps):
+            out.write("%d\n" % steps)
+    except ValueError as e:
+        out.flush()
+        parser.exit(2, "%s: error: %s\n" % (parser.prog, e))
+    out.flush()
+    return 1 if mismatches else 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
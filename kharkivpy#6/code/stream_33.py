@@ -12,16 +12,165 @@
 ############################################
 
 from operator import add
-from itertools import islice, chain
-from sys import maxint
+from itertools import islice, chain, accumulate, count, groupby, product
+from collections import deque
+from collections.abc import Sequence
+from bisect import bisect_right
+from heapq import heapify, heapreplace, heappop
+from weakref import WeakSet
+from array import array
+from threading import RLock, Thread, Event
+from queue import Queue, Full
+from multiprocessing import Pool, cpu_count
+from multiprocessing.pool import ThreadPool
+from mmap import mmap, ACCESS_READ
+from timeit import default_timer as timer
+import pickle
+import os
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 # shortcuts
 def take(limit, base): return islice(base, limit)
 def drop(limit, base): return islice(base, limit, None)
 
+def _pool_map(pool_class, fn, iterable, workers, prefetch):
+    # ordered map with no more than prefetch tasks in flight,
+    # pool is started only when first result is requested
+    pool = pool_class(workers or cpu_count())
+    prefetch = prefetch or 2 * (workers or cpu_count())
+    pending = deque()
+    try:
+        for n in iterable:
+            pending.append(pool.apply_async(fn, (n,)))
+            if len(pending) >= prefetch:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+    finally:
+        pool.terminate()
+
+def _drain(sources):
+    # each source stays at the head of queue until it's exhausted, so
+    # chain over this generator is flat no matter how many sources
+    while sources:
+        yield sources[0]
+        sources.popleft()
+
+def _merge(iterators, key, unique):
+    # heap of (key, order, element, iterator) heads, order is unique
+    # so neither elements nor iterators are ever compared
+    heap = []
+    for order, it in enumerate(iterators):
+        for n in it:
+            heap.append((key(n) if key else n, order, n, it))
+            break
+    heapify(heap)
+    last = object()
+    while heap:
+        k, order, n, it = heap[0]
+        if not (unique and k == last): yield n
+        last = k
+        for n in it:
+            heapreplace(heap, (key(n) if key else n, order, n, it))
+            break
+        else:
+            heappop(heap)
+
+def _join(iterators, key):
+    # merge join: advance groups that are behind the largest key
+    # until all of them are equal
+    groups = [groupby(it, key) for it in iterators]
+    try:
+        heads = [next(g) for g in groups]
+        while True:
+            top = max(k for k, _ in heads)
+            if all(k == top for k, _ in heads):
+                yield from product(*[list(g) for _, g in heads])
+                heads = [next(g) for g in groups]
+            else:
+                heads = [h if h[0] == top else next(g) for h, g in zip(heads, groups)]
+    except StopIteration:
+        return
+
+class _ReadAhead:
+    """Iterator that pulls origin in background thread, keeping at most
+    size elements ready. Thread has no reference to this object, so it's
+    stopped as soon as iterator is garbage collected."""
+
+    __slots__ = ("_queue", "_stop", "_thread", "_done")
+
+    def __init__(self, origin, size):
+        self._queue = Queue(size)
+        self._stop = Event()
+        self._done = False
+        self._thread = Thread(target=_read_ahead, args=(origin, self._queue, self._stop))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._done: raise StopIteration()
+        ok, value = self._queue.get()
+        if ok: return value
+        self._done = True
+        if value is not None: raise value
+        raise StopIteration()
+
+    def __del__(self):
+        self._stop.set()
+
+def _read_ahead(origin, queue, stop):
+    def put(item):
+        # blocks while queue is full (backpressure), but checks
+        # from time to time that consumer is still alive
+        while not stop.is_set():
+            try:
+                queue.put(item, timeout=0.1)
+                return True
+            except Full:
+                pass
+        return False
+
+    try:
+        for n in origin:
+            if not put((True, n)): return
+    except Exception as e:
+        put((False, e))
+    else:
+        put((False, None))
+
+class StreamStats:
+    """Counters collected by instrumented stream: calls to _fill_to,
+    hits (served from memo) and pulls (went to origin), elements
+    materialized, peak size of collection and time spent in origin."""
+
+    __slots__ = ("calls", "hits", "pulls", "materialized", "peak", "origin_time", "on_pull")
+
+    def __init__(self, on_pull=None):
+        self.calls = self.hits = self.pulls = self.materialized = self.peak = 0
+        self.origin_time = 0.0
+        self.on_pull = on_pull
+
+    def __repr__(self):
+        return ("StreamStats(calls={0.calls}, hits={0.hits}, pulls={0.pulls}, "
+                "materialized={0.materialized}, peak={0.peak}, "
+                "origin_time={0.origin_time:.6f})").format(self)
+
 class Stream:
 
-    __slots__ = ("_last", "_collection", "_origin")
+    __slots__ = ("_collection", "_origin", "_sources", "_chunk",
+                 "_starts", "_segments", "_sized", "_length", "_stats",
+                 "_parent", "_busy")
+
+    # sized sources at the head of stream are indexed directly,
+    # without copying them into collection
+    _indexed = True
 
     class _StreamIterator:
         
@@ -31,56 +180,743 @@ class Stream:
             self._stream = stream
             self._position = -1 # not started yet
 
+        def __iter__(self):
+            return self
+
         def __next__(self):
             # check if elements are available for next position
             # return next element or raise StopIteration
             self._position += 1
-            if self._stream._fill_to(self._position):
-                return self._stream._collection[self._position]
+            stream = self._stream
+            index = self._position - stream._sized
+            if index < 0:
+                return stream._at(self._position)
+
+            collection = stream._collection
+            if (index < len(collection) and stream._stats is None) or stream._fill_to(self._position):
+                return collection[index]
 
             raise StopIteration()
 
-    def __init__(self):
+    def __init__(self, chunk=1):
         self._collection = []
-        self._last = -1 # not started yet
-        self._origin = []
+        self._origin = iter([])
+        self._sources = deque() # flat queue of not drained iterators
+        self._chunk = chunk # how many elements to pull from origin at once
+        self._starts = [] # first position of each sized segment
+        self._segments = []
+        self._sized = 0 # total length of sized segments
+        self._length = 0 # None when it's not known yet
+        self._stats = None
+        self._parent = None # stream this one is a slice of
+        self._busy = 0 # pulls from origin in progress
 
     def __lshift__(self, rvalue):
         iterator = rvalue() if callable(rvalue) else rvalue
-        self._origin = chain(self._origin, iterator)
+        if self._indexed and self._length == self._sized and isinstance(iterator, Sequence):
+            if len(iterator):
+                self._starts.append(self._sized)
+                self._segments.append(iterator)
+                self._sized += len(iterator)
+            self._length = self._sized
+        else:
+            self._sources.append(iter(iterator))
+            self._restart()
+            self._length = None
         return self
 
+    def _restart(self):
+        # previous origin could already be exhausted, new one starts from
+        # the source that is not drained yet (it's still at the head)
+        self._origin = chain.from_iterable(_drain(self._sources))
+
+    def _at(self, index):
+        # element of sized segments, that are sorted by start position
+        if self._stats is not None: self._stats.hits += 1
+        segment = bisect_right(self._starts, index) - 1
+        return self._segments[segment][index - self._starts[segment]]
+
     def _fill_to(self, index):
-        if self._last >= index:
+        need = index - self._filled() + 1
+        stats = self._stats
+        if stats is not None: stats.calls += 1
+        if need <= 0:
+            if stats is not None: stats.hits += 1
             return True
 
-        while self._last < index:
+        if self._length is not None and index >= self._length:
+            return False # origin is known to be exhausted
+
+        self._busy += 1
+        try:
+            if stats is not None:
+                return self._pull_counted(index, need)
+            return self._pull(index, need)
+        finally:
+            self._busy -= 1
+
+    def _pull_counted(self, index, need):
+        stats = self._stats
+        before, started = self._filled(), timer()
+        filled = self._pull(index, need)
+        stats.origin_time += timer() - started
+        stats.pulls += 1
+        pulled = self._filled() - before
+        stats.materialized += pulled
+        stats.peak = max(stats.peak, self._memoized())
+        if stats.on_pull is not None:
+            for i, n in enumerate(self._tail(pulled)):
+                stats.on_pull(before + i, n)
+        return filled
+
+    def _memoized(self):
+        # number of elements kept in memory (or in index)
+        return len(self._collection)
+
+    def _tail(self, count):
+        # last count elements pulled from origin
+        collection = self._collection
+        return islice(collection, len(collection) - count, None)
+
+    def _pull(self, index, need):
+        collection = self._collection
+        if need < self._chunk:
+            need = self._chunk
+
+        if need == 1:
             try:
-                n = next(self._origin)
+                collection.append(next(self._origin))
             except StopIteration:
+                self._length = self._filled()
                 return False
+            return True
 
-            self._last += 1
-            self._collection.append(n)
+        # collection is extended element by element, so self-referencing
+        # origin could read what is already pulled during the same call
+        before = self._filled()
+        collection.extend(islice(self._origin, need))
+        if self._filled() - before < need:
+            self._length = self._filled()
+        return self._filled() > index
 
-        return True
+    def take_chunk(self, start, size):
+        """List of (at most) size elements starting from given position"""
+        end = start + size
+        self._fill_to(end - 1)
+        block = []
+        segment = max(bisect_right(self._starts, start) - 1, 0)
+        for first, base in zip(self._starts[segment:], self._segments[segment:]):
+            if first >= end: break
+            block.extend(base[max(start - first, 0):end - first])
+        low, high = max(start - self._sized, 0), max(end - self._sized, 0)
+        return block + self._collection[low:high]
+
+    def chunks(self, size):
+        """Iterate over stream by blocks, the last one could be shorter"""
+        position = 0
+        while True:
+            block = self.take_chunk(position, size)
+            if block: yield block
+            if len(block) < size: return
+            position += size
+
+    @classmethod
+    def from_file(cls, path, chunk=1):
+        """Stream of file lines, see FileStream"""
+        return FileStream(path, chunk)
+
+    @staticmethod
+    def merge(*streams, key=None, unique=False):
+        """Lazy merge of sorted (maybe infinite) streams, O(log k) per
+        element. Equal elements are taken in order of streams, with
+        unique=True only first of them is kept."""
+        return Stream() << _merge([iter(s) for s in streams], key, unique)
+
+    @staticmethod
+    def join(*streams, key=None):
+        """Stream of tuples of elements with equal keys, one element from
+        each of sorted streams (all combinations for repeated keys)"""
+        return Stream() << _join([iter(s) for s in streams], key)
+
+    def pmap(self, fn, workers=None, prefetch=None):
+        """Stream of fn applied to elements in pool of processes.
+
+        Order of elements is kept and at most prefetch elements are
+        computed ahead of consumer, so infinite stream is fine here.
+        fn and elements should be picklable.
+        """
+        return Stream() << _pool_map(Pool, fn, iter(self), workers, prefetch)
+
+    def tmap(self, fn, workers=None, prefetch=None):
+        """Same as pmap, but with pool of threads"""
+        return Stream() << _pool_map(ThreadPool, fn, iter(self), workers, prefetch)
+
+    def readahead(self, size=64):
+        """Pull origin in background thread, so up to size elements are
+        always ready. Meant for I/O-bound origins, like files or sockets,
+        not for self-referencing ones."""
+        origin = chain.from_iterable(_drain(self._sources))
+        self._sources = deque([_ReadAhead(origin, size)])
+        self._restart()
+        return self
 
     def __iter__(self):
-        return Stream._StreamIterator(self)
+        return self._StreamIterator(self)
+
+    def instrument(self, on_pull=None):
+        """Start collecting stream.stats, on_pull(index, value)
+        is called for each element pulled from origin"""
+        self._stats = StreamStats(on_pull)
+        return self
+
+    @property
+    def stats(self):
+        return self._stats
+
+    def __len__(self):
+        if self._length is None: raise TypeError("Length of stream is not known yet")
+        return self._length
+
+    def _view(self):
+        # empty stream of the same kind to be filled from slice
+        return Stream()
+
+    def _filled(self):
+        # how many elements are already available
+        return self._sized + len(self._collection)
 
     def __getitem__(self, index):
         if isinstance(index, int):
-            # todo: i'm not sure what to do with negative indices
-            if index < 0: raise TypeError, "Invalid argument type"
+            # negative indices work only when length is known
+            if index < 0: index += len(self)
+            if index < 0: raise IndexError("Stream index out of range")
+            if index < self._sized: return self._at(index)
             self._fill_to(index)
+            return self._collection.__getitem__(index - self._sized)
+        elif isinstance(index, slice):
+            low, high, step = index.start or 0, index.stop, 1 if index.step is None else index.step
+            if step == 0: raise ValueError("slice step cannot be zero")
+            if step < 0:
+                # backward slice needs the end of stream, so it works
+                # only when length is known
+                indices = range(*index.indices(len(self)))
+                return self._view() << (self[i] for i in indices)
+            if low < 0 or (high is not None and high < 0):
+                low, high, step = index.indices(len(self))
+            # slice is a view on current stream: elements are pulled
+            # from the parent only when view itself is consumed
+            cursor = iter(self)
+            cursor._position = low - 1 # no need to walk through head
+            size = None if high is None else max(high - low, 0)
+            view = self._view()
+            view._parent = self
+            return view << islice(cursor, 0, size, step)
+        else:
+            raise TypeError("Invalid argument type")
+
+class WindowedStream(Stream):
+    """Stream that keeps in memory only elements that are still reachable
+    by live iterators, prefix that nobody could read anymore is dropped.
+
+    Random access works only for elements ahead of the window.
+    """
+
+    __slots__ = ("_offset", "_cursors")
+
+    _indexed = False
+
+    class _StreamIterator(Stream._StreamIterator):
+
+        __slots__ = ("__weakref__",)
+
+        def __next__(self):
+            self._position += 1
+            stream = self._stream
+            if self._position < stream._offset:
+                raise IndexError("Element is already evicted from window")
+            if stream._fill_to(self._position):
+                return stream._collection[self._position - stream._offset]
+
+            raise StopIteration()
+
+    def __init__(self, chunk=1):
+        Stream.__init__(self, chunk)
+        self._collection = deque()
+        self._offset = 0 # position of the first element in collection
+        self._cursors = WeakSet()
+
+    def __iter__(self):
+        cursor = self._StreamIterator(self)
+        self._cursors.add(cursor)
+        return cursor
+
+    def _view(self):
+        return WindowedStream()
+
+    def _filled(self):
+        return self._offset + len(self._collection)
+
+    def _evict(self, keep):
+        # each iterator needs element right after its position,
+        # everything before the lowest of them (and keep) is dropped
+        low = min([c._position + 1 for c in self._cursors] + [keep])
+        while self._offset < low:
+            self._collection.popleft()
+            self._offset += 1
+
+    def _fill_to(self, index, keep=None):
+        # filled by chunks, prefix nobody needs is dropped before each
+        # of them, so random access far ahead doesn't grow the window
+        while self._filled() <= index:
+            end = self._filled()
+            self._evict(end if keep is None else keep)
+            if not Stream._fill_to(self, min(index, end + self._chunk - 1)):
+                return False
+
+        return True
+
+    def take_chunk(self, start, size):
+        self._fill_to(start + size - 1, keep=start)
+        if start < self._offset: raise IndexError("Element is already evicted from window")
+        low = start - self._offset
+        return list(islice(self._collection, low, low + size))
+
+    def __getitem__(self, index):
+        if isinstance(index, int):
+            # negative indices work only when length is known
+            if index < 0: index += len(self)
+            if index < 0 or not self._fill_to(index): raise IndexError("Stream index out of range")
+            if index < self._offset: raise IndexError("Element is already evicted from window")
+            return self._collection[index - self._offset]
+
+        return Stream.__getitem__(self, index)
+
+class TypedStream(Stream):
+    """Stream of numbers stored unboxed in array.array blocks.
+
+    Blocks are allocated at full size and never resized, so slices
+    handed out as memoryview stay valid while stream is growing.
+    Slices crossing block boundary (or open-ended) are not zero-copy.
+    """
+
+    __slots__ = ("_typecode", "_size")
+
+    _indexed = False
+
+    block = 4096 # elements per block
+
+    class _StreamIterator(Stream._StreamIterator):
+
+        def __next__(self):
+            self._position += 1
+            stream = self._stream
+            if self._position < stream._size or stream._fill_to(self._position):
+                block, offset = divmod(self._position, stream.block)
+                return stream._collection[block][offset]
+
+            raise StopIteration()
+
+    def __init__(self, typecode, chunk=1):
+        Stream.__init__(self, chunk)
+        self._typecode = typecode
+        self._size = 0
+
+    def _pull(self, index, need):
+        for n in islice(self._origin, max(need, self._chunk)):
+            block, offset = divmod(self._size, self.block)
+            if not offset:
+                self._collection.append(array(self._typecode, [0]) * self.block)
+            self._collection[block][offset] = n
+            self._size += 1
+
+        if self._size > index:
+            return True
+        self._length = self._size
+        return False
+
+    def _memoized(self):
+        return self._size
+
+    def _tail(self, count):
+        return map(self.__getitem__, range(self._size - count, self._size))
+
+    def take_chunk(self, start, size):
+        return self[start:start + size]
+
+    def _filled(self):
+        return self._size
+
+    def __getitem__(self, index):
+        if isinstance(index, int):
+            if index < 0: raise TypeError("Invalid argument type")
+            if not self._fill_to(index): raise IndexError("Stream index out of range")
+            block, offset = divmod(index, self.block)
+            return self._collection[block][offset]
+        elif isinstance(index, slice) and (index.step or 1) < 0:
+            # backward slice needs the end of stream, length should be known
+            indices = range(*index.indices(len(self)))
+            return memoryview(array(self._typecode, [self[i] for i in indices]))
+        elif isinstance(index, slice) and index.stop is not None:
+            low, high, step = index.start or 0, index.stop, 1 if index.step is None else index.step
+            if step == 0: raise ValueError("slice step cannot be zero")
+            if low < 0 or step < 1 or high < 0: raise TypeError("Invalid argument type")
+            self._fill_to(high - 1)
+            high = min(high, self._size)
+            if low >= high:
+                return memoryview(array(self._typecode))
+
+            block, offset = divmod(low, self.block)
+            if (high - 1) // self.block == block:
+                return memoryview(self._collection[block])[offset:offset + high - low:step]
+            return memoryview(array(self._typecode, islice(self, low, high, step)))
         elif isinstance(index, slice):
-            # todo: reimplement to work lazy
-            low, high, step = index.indices(maxint)
-            self._fill_to(max(low, high))
+            low, step = index.start or 0, 1 if index.step is None else index.step
+            if step == 0: raise ValueError("slice step cannot be zero")
+            if low < 0 or step < 1: raise TypeError("Invalid argument type")
+            view = TypedStream(self._typecode)
+            view._parent = self
+            return view << islice(self, low, None, step)
         else:
-            raise TypeError, "Invalid argument type"
+            raise TypeError("Invalid argument type")
+
+    def asarray(self, start, stop):
+        """NumPy array sharing memory with stream elements (when possible)"""
+        if np is None: raise RuntimeError("NumPy is not available")
+        return np.asarray(self[start:stop])
+
+class ConcurrentStream(Stream):
+    """Stream that could be shared between threads.
+
+    Only one thread at a time pulls elements from origin, other threads
+    wait for it. Already filled positions are read without locking, as
+    collection is only appended to. Each thread should use its own
+    iterator: single iterator is not safe to share.
+    """
+
+    __slots__ = ("_lock",)
+
+    def __init__(self, chunk=1):
+        Stream.__init__(self, chunk)
+        # reentrant, so self-referencing origin could read from stream
+        self._lock = RLock()
+
+    def _fill_to(self, index):
+        if self._sized + len(self._collection) > index:
+            return True
+
+        with self._lock:
+            return Stream._fill_to(self, index)
+
+    def _view(self):
+        return ConcurrentStream()
+
+class FileStream(Stream):
+    """Lines of file (as bytes, with line endings) as stream.
+
+    File is memory-mapped and only offsets of line ends are collected,
+    lazily, as stream advances. Line is copied only when it's requested,
+    slices of lines are zero-copy memoryviews of the mapping. Offsets
+    are saved to path + ".lines" on close and reused while file has
+    the same size and modification time.
+    """
+
+    __slots__ = ("_file", "_map", "_ends", "_stamp")
+
+    _indexed = False
+
+    class _StreamIterator(Stream._StreamIterator):
+
+        def __next__(self):
+            self._position += 1
+            if self._stream._fill_to(self._position):
+                return self._stream._line(self._position)
+
+            raise StopIteration()
+
+    def __init__(self, path, chunk=1):
+        Stream.__init__(self, chunk)
+        self._file = open(path, "rb")
+        stat = os.fstat(self._file.fileno())
+        self._stamp = array("Q", [stat.st_size, int(stat.st_mtime * 10**6)])
+        self._map = mmap(self._file.fileno(), 0, access=ACCESS_READ) if stat.st_size else b""
+        self._ends = array("Q")
+        self._length = None
+        try:
+            with open(path + ".lines", "rb") as index:
+                saved = array("Q")
+                saved.frombytes(index.read())
+        except IOError:
+            pass
+        else:
+            if saved[:2] == self._stamp:
+                self._ends = saved[2:]
+
+    def save_index(self):
+        with open(self._file.name + ".lines", "wb") as index:
+            index.write((self._stamp + self._ends).tobytes())
+
+    def close(self):
+        """Save index and close file. Mapping stays open while slices
+        of lines are alive, it's released together with the last one"""
+        self.save_index()
+        try:
+            if self._map: self._map.close()
+        except BufferError:
+            pass # exported memoryviews still use it
+        finally:
+            self._file.close()
+
+    def _pull(self, index, need):
+        size, ends = len(self._map), self._ends
+        start = ends[-1] if ends else 0
+        for _ in range(max(need, self._chunk)):
+            if start >= size:
+                self._length = len(ends)
+                break
+            end = self._map.find(b"\n", start) + 1 or size
+            ends.append(end)
+            start = end
+
+        return len(ends) > index
+
+    def _memoized(self):
+        return len(self._ends)
+
+    def _tail(self, count):
+        return map(self._line, range(len(self._ends) - count, len(self._ends)))
+
+    def _filled(self):
+        return len(self._ends)
+
+    def __len__(self):
+        # number of lines is known only when the whole file is indexed
+        while self._length is None:
+            self._fill_to(len(self._ends) + (1 << 16))
+        return self._length
+
+    def _line(self, index):
+        start = self._ends[index - 1] if index else 0
+        return self._map[start:self._ends[index]]
+
+    def take_chunk(self, start, size):
+        self._fill_to(start + size - 1)
+        return [self._line(i) for i in range(start, min(start + size, len(self._ends)))]
+
+    def __getitem__(self, index):
+        if isinstance(index, int):
+            if index < 0: index += len(self)
+            if index < 0 or not self._fill_to(index): raise IndexError("Stream index out of range")
+            return self._line(index)
+        elif isinstance(index, slice) and index.stop is not None and index.step in (None, 1):
+            low, high = index.start or 0, index.stop
+            if low < 0 or high < 0: low, high, _ = index.indices(len(self))
+            self._fill_to(high - 1)
+            high = min(high, len(self._ends))
+            if low >= high: return memoryview(b"")
+            start = self._ends[low - 1] if low else 0
+            return memoryview(self._map)[start:self._ends[high - 1]]
+
+        return Stream.__getitem__(self, index)
+
+class SpillStream(Stream):
+    """Stream that moves memoized elements to disk once there are more
+    than threshold of them in memory.
+
+    Elements are pickled one after another into file at path, offsets
+    of their ends go to path + ".idx". Data file is memory-mapped, so
+    random access to spilled elements is still cheap. Both files are
+    reused when stream with the same path is created again, origin of
+    such stream should start from stream.spilled position.
+    """
+
+    __slots__ = ("_threshold", "_ends", "_data", "_index", "_map")
 
-        return self._collection.__getitem__(index)
+    _indexed = False
+
+    class _StreamIterator(Stream._StreamIterator):
+
+        def __next__(self):
+            self._position += 1
+            if self._stream._fill_to(self._position):
+                return self._stream._get(self._position)
+
+            raise StopIteration()
+
+    def __init__(self, path, threshold=1 << 16, chunk=1):
+        Stream.__init__(self, chunk)
+        self._threshold = threshold
+        self._ends = array("Q")
+        self._index = open(path + ".idx", "a+b")
+        self._index.seek(0)
+        data = self._index.read()
+        self._ends.frombytes(data[:len(data) - len(data) % self._ends.itemsize])
+        self._data = open(path, "a+b")
+        # drop partially written tails left by crashed process, on disk
+        # too: both files are opened for append
+        self._index.truncate(len(self._ends) * self._ends.itemsize)
+        self._data.truncate(self._ends[-1] if self._ends else 0)
+        self._map = None
+        self._remap()
+        self._length = None # not known until origin is exhausted
+
+    @property
+    def spilled(self):
+        return len(self._ends)
+
+    def _remap(self):
+        if self._map is not None: self._map.close()
+        if self._ends:
+            self._map = mmap(self._data.fileno(), 0, access=ACCESS_READ)
+
+    def _spill(self):
+        ends = array("Q")
+        end = self._ends[-1] if self._ends else 0
+        for n in self._collection:
+            data = pickle.dumps(n, pickle.HIGHEST_PROTOCOL)
+            self._data.write(data)
+            end += len(data)
+            ends.append(end)
+        # data goes first, so index never points to missing data
+        self._data.flush()
+        self._index.write(ends.tobytes())
+        self._index.flush()
+        self._ends.extend(ends)
+        del self._collection[:]
+        self._remap()
+
+    def flush(self):
+        """Move everything that is memoized to disk"""
+        if self._collection: self._spill()
+
+    def close(self):
+        self.flush()
+        if self._map is not None: self._map.close()
+        self._data.close()
+        self._index.close()
+
+    def _fill_to(self, index):
+        while self._filled() <= index:
+            # never keep much more than threshold elements in memory
+            top = min(index, len(self._ends) + self._threshold - 1)
+            filled = Stream._fill_to(self, top)
+            if len(self._collection) >= self._threshold: self._spill()
+            if not filled: return False
+
+        return True
+
+    def _filled(self):
+        return len(self._ends) + len(self._collection)
+
+    def _get(self, index):
+        if index >= len(self._ends):
+            return self._collection[index - len(self._ends)]
+        start = self._ends[index - 1] if index else 0
+        return pickle.loads(self._map[start:self._ends[index]])
+
+    def take_chunk(self, start, size):
+        self._fill_to(start + size - 1)
+        return [self._get(i) for i in range(start, min(start + size, self._filled()))]
+
+    def __getitem__(self, index):
+        if isinstance(index, int):
+            # negative indices work only when length is known
+            if index < 0: index += len(self)
+            if index < 0 or not self._fill_to(index): raise IndexError("Stream index out of range")
+            return self._get(index)
+
+        return Stream.__getitem__(self, index)
+
+# block-wise combinators: each step works with a block of memoized
+# elements, so per-element work happens inside of map/zip/filter
+# (or NumPy ufunc for TypedStream) instead of Python code
+
+BLOCK = 4096 # max elements per block
+
+def _stream(base):
+    return base if isinstance(base, Stream) else Stream() << base
+
+def _busy(stream):
+    # stream (or the one it's a slice of) is pulling from origin right
+    # now, so block is requested by its own definition
+    while stream is not None:
+        if stream._busy: return True
+        stream = stream._parent
+    return False
+
+def _blocks(*streams):
+    # aligned blocks of all streams, BLOCK elements each. Self-referencing
+    # stream could be filled only one step ahead of what it has already
+    # computed, so while it's busy blocks are whatever is memoized but at
+    # least one new element. It should be read through its slices (f[1:]),
+    # not raw iterators: they are not known to depend on it
+    position = 0
+    while True:
+        size = BLOCK
+        if any(map(_busy, streams)):
+            size = max(1, min([BLOCK] + [s._filled() - position for s in streams]))
+        blocks = [s.take_chunk(position, size) for s in streams]
+        size = min(map(len, blocks))
+        if not size: return
+        yield [b[:size] for b in blocks]
+        position += size
+
+def _vectorized(fn, streams):
+    return np is not None and isinstance(fn, np.ufunc) \
+        and all(isinstance(s, TypedStream) for s in streams)
+
+def _unboxed(probe):
+    # stream for ufunc results, unboxed when array supports their type,
+    # so the next combinator is vectorized too
+    try:
+        array(probe.dtype.char)
+    except (ValueError, TypeError):
+        return Stream()
+    return TypedStream(probe.dtype.char)
+
+def _probe(typecode):
+    return np.zeros(1, dtype=typecode)
+
+def smap(fn, *streams):
+    streams = list(map(_stream, streams))
+    if _vectorized(fn, streams):
+        result = _unboxed(fn(*[_probe(s._typecode) for s in streams]))
+        blocks = (fn(*map(np.asarray, b)).tolist() for b in _blocks(*streams))
+    else:
+        result = Stream()
+        blocks = (list(map(fn, *b)) for b in _blocks(*streams))
+    return result << chain.from_iterable(blocks)
+
+def szip(*streams):
+    streams = list(map(_stream, streams))
+    return Stream() << chain.from_iterable(list(zip(*b)) for b in _blocks(*streams))
+
+def sfilter(pred, stream):
+    stream = _stream(stream)
+    if _vectorized(pred, [stream]):
+        result = TypedStream(stream._typecode)
+        blocks = (a[pred(a)].tolist() for a in (np.asarray(b) for b, in _blocks(stream)))
+    else:
+        result = Stream()
+        blocks = (list(filter(pred, b)) for b, in _blocks(stream))
+    return result << chain.from_iterable(blocks)
+
+def scan(fn, stream, initial):
+    """Stream of accumulated values, starting from initial"""
+    stream = _stream(stream)
+    vectorized = _vectorized(fn, [stream])
+    result = Stream()
+    if vectorized:
+        result = _unboxed(fn.accumulate(np.concatenate(([initial], _probe(stream._typecode)))))
+    def blocks(acc):
+        yield [acc]
+        for b, in _blocks(stream):
+            if vectorized:
+                block = fn.accumulate(np.concatenate(([acc], np.asarray(b))))[1:].tolist()
+            else:
+                block = list(accumulate(chain([acc], b), fn))[1:]
+            acc = block[-1]
+            yield block
+    return result << chain.from_iterable(blocks(initial))
 
 #----------------------------------    
 # Simple cases 
@@ -89,7 +925,7 @@ class Stream:
 s = Stream() << [1,2,3,4,5]
 assert list(s) == [1,2,3,4,5]
 assert s[1] == 2
-assert s[0:2] == [1,2]
+assert list(s[0:2]) == [1,2]
 
 s = Stream() << range(6) << [6,7]
 assert list(s) == [0,1,2,3,4,5,6,7]
@@ -110,4 +946,427 @@ fib = f << [0, 1] << map(add, f, drop(1, f))
 
 assert list(take(10, fib)) == [0,1,1,2,3,5,8,13,21,34]
 assert fib[20] == 6765
-assert fib[30:35] == [832040,1346269,2178309,3524578,5702887]
\ No newline at end of file
+assert list(fib[30:35]) == [832040,1346269,2178309,3524578,5702887]
+
+#----------------------------------    
+# Lazy slices
+#----------------------------------    
+f = Stream()
+fib = f << [0, 1] << map(add, f, drop(1, f))
+
+tail = fib[10**6:] # nothing is calculated here
+assert len(fib._collection) == 0
+assert list(take(5, fib[::2])) == [0,1,3,8,21]
+assert list(take(3, fib[10::10])) == [55,6765,832040]
+assert fib[40:][0] == fib[40]
+assert fib._filled() == 41
+
+# backward slices work when length is known
+s = Stream() << range(1, 6)
+assert list(s[::-1]) == [5,4,3,2,1] and list(s[3:0:-1]) == [4,3,2]
+s = TypedStream("l") << iter(range(1, 6))
+try:
+    s[::-1]
+except TypeError:
+    pass
+else:
+    assert False, "length is not known yet"
+assert list(s) == [1,2,3,4,5] and list(s[3:0:-1]) == [4,3,2]
+
+# zero step is an error, same as for lists
+for s in (fib, TypedStream("l") << [1, 2, 3]):
+    for index in (slice(1, 2, 0), slice(1, None, 0)):
+        try:
+            s[index]
+        except ValueError:
+            pass
+        else:
+            assert False, "ValueError expected"
+
+#----------------------------------    
+# Bounded memory
+#----------------------------------    
+f = WindowedStream()
+fib = f << [0, 1] << map(add, f, drop(1, f))
+
+for i, n in enumerate(fib):
+    if i == 1000: break
+    assert len(f._collection) <= 3
+
+assert n % 10**6 == 228875
+assert fib[2000] % 10**6 == 817125
+assert len(f._collection) <= 3 # random access is bounded too
+assert list(take(2, fib[3000:]))[0] % 10**6 == 796000
+assert len(f._collection) <= 3
+
+# new iterators and slices can't go back to evicted prefix
+for view in (lambda: iter(fib), lambda: iter(fib[10:20])):
+    try:
+        next(view())
+    except IndexError:
+        pass
+    else:
+        assert False, "evicted prefix should not be readable"
+
+#----------------------------------    
+# Chunked filling
+#----------------------------------    
+s = Stream(chunk=4) << iter(range(10))
+assert s[0] == 0
+assert len(s._collection) == 4
+assert s.take_chunk(2, 5) == [2,3,4,5,6]
+assert list(s.chunks(4)) == [[0,1,2,3],[4,5,6,7],[8,9]]
+assert s.take_chunk(8, 5) == [8,9]
+
+f = Stream(chunk=64)
+fib = f << [0, 1] << map(add, f, drop(1, f))
+assert list(take(10, fib)) == [0,1,1,2,3,5,8,13,21,34]
+assert f._filled() == 66
+assert fib.take_chunk(30, 5) == [832040,1346269,2178309,3524578,5702887]
+
+f = WindowedStream(chunk=16)
+fib = f << [0, 1] << map(add, f, drop(1, f))
+assert [block[0] for block in take(3, fib.chunks(10))] == [0,55,6765]
+
+assert list(WindowedStream(chunk=4) << iter(range(10))) == list(range(10))
+s = WindowedStream(chunk=4) << iter(range(10))
+assert list(s.chunks(4)) == [[0,1,2,3],[4,5,6,7],[8,9]]
+assert s[9] == 9
+
+w = WindowedStream() << iter(range(10))
+cursor = iter(w)
+for _ in range(7): next(cursor) # holds window from 7
+try:
+    w[10]
+except IndexError:
+    pass
+else:
+    assert False, "IndexError expected"
+assert w[9] == 9 and w[-1] == 9 and w[-3] == 7
+
+#----------------------------------    
+# Typed numeric streams
+#----------------------------------    
+f = TypedStream("l")
+fib = f << [0, 1] << map(add, f, drop(1, f))
+assert list(take(10, fib)) == [0,1,1,2,3,5,8,13,21,34]
+assert fib[50] == 12586269025
+assert list(fib[30:35]) == [832040,1346269,2178309,3524578,5702887]
+assert list(fib[10:40:10]) == [55,6765,832040]
+
+s = TypedStream("d", chunk=1000) << (i / 2.0 for i in range(10000))
+assert s[0] == 0.0
+assert s._size == 1000
+assert list(s[4094:4098]) == [2047.0,2047.5,2048.0,2048.5]
+assert list(s.take_chunk(9998, 5)) == [4999.0,4999.5]
+assert list(take(3, s[9000::100])) == [4500.0,4550.0,4600.0]
+
+view = s[10:20]
+assert isinstance(view, memoryview)
+assert view.tolist() == [i / 2.0 for i in range(10, 20)]
+assert view.obj is s._collection[0] # no copy
+
+if np is not None:
+    assert s.asarray(10, 20).sum() == 72.5
+
+#----------------------------------    
+# Many threads, one producer
+#----------------------------------    
+pulled = []
+def producer():
+    for i in range(10000):
+        pulled.append(i)
+        yield i
+
+s = ConcurrentStream() << producer
+results = []
+workers = [Thread(target=lambda: results.append(sum(s))) for _ in range(8)]
+for w in workers: w.start()
+for w in workers: w.join()
+assert results == [sum(range(10000))] * 8
+assert len(pulled) == 10000
+
+f = ConcurrentStream()
+fib = f << [0, 1] << map(add, f, drop(1, f))
+results = []
+workers = [Thread(target=lambda: results.append(list(take(100, fib[::3])))) for _ in range(4)]
+for w in workers: w.start()
+for w in workers: w.join()
+assert len(results) == 4 and all(r == results[0] for r in results)
+assert results[0][:5] == [0,2,8,34,144]
+
+#----------------------------------    
+# Block-wise combinators
+#----------------------------------    
+f = Stream()
+fib = f << [0, 1] << smap(add, f, f[1:])
+assert list(take(10, fib)) == [0,1,1,2,3,5,8,13,21,34]
+assert fib[100] == 354224848179261915075
+
+s = Stream() << range(10000)
+squares = smap(lambda x: x * x, s)
+assert squares.take_chunk(9998, 5) == [9998 ** 2, 9999 ** 2]
+assert list(take(3, szip(s, squares[1:]))) == [(0,1),(1,4),(2,9)]
+assert list(take(4, sfilter(lambda x: x % 3 == 0, s[1:]))) == [3,6,9,12]
+assert list(take(5, scan(add, s, 0))) == [0,0,1,3,6]
+assert scan(add, s, 0)[10000] == sum(range(10000))
+
+# lazy sources are read by full blocks, not element by element
+s = Stream() << iter(range(10000))
+assert [len(b) for b, in _blocks(s)] == [BLOCK, BLOCK, 10000 - 2 * BLOCK]
+
+if np is not None:
+    f = TypedStream("l")
+    fib = f << [0, 1] << smap(np.add, f, f[1:])
+    assert list(take(10, fib)) == [0,1,1,2,3,5,8,13,21,34]
+
+    s = TypedStream("d", chunk=BLOCK) << (i / 2.0 for i in range(10000))
+    squares = smap(np.multiply, s, s)
+    assert list(squares.take_chunk(9998, 5)) == [4999.0 ** 2, 4999.5 ** 2]
+    assert isinstance(squares, TypedStream) # next step is vectorized too
+    assert list(take(3, smap(np.sqrt, squares[1:]))) == [0.5, 1.0, 1.5]
+    assert list(take(3, sfilter(np.isfinite, s))) == [0.0, 0.5, 1.0]
+    assert scan(np.add, s, 0.0)[10000] == sum(i / 2.0 for i in range(10000))
+
+#----------------------------------    
+# Spilling to disk
+#----------------------------------    
+import os, shutil, tempfile
+tmp = tempfile.mkdtemp()
+path = os.path.join(tmp, "numbers")
+
+s = SpillStream(path, threshold=100) << range(1050)
+assert s[1049] == 1049
+assert s.spilled == 1000 and len(s._collection) == 50
+assert s[5] == 5 and list(s[440:443]) == [440,441,442]
+assert s.take_chunk(998, 4) == [998,999,1000,1001]
+s.close()
+
+s = SpillStream(path, threshold=100)
+assert s.spilled == 1050
+assert s[500] == 500 # without origin
+s << range(s.spilled, 1200)
+assert list(take(3, s[1049:])) == [1049,1050,1051]
+assert list(s)[-1] == 1199
+s.close()
+
+f = SpillStream(os.path.join(tmp, "fib"), threshold=10)
+fib = f << [0, 1] << map(add, f, drop(1, f))
+assert fib[1000] % 10**6 == 228875
+assert fib[20] == 6765
+f.close()
+
+s = SpillStream(os.path.join(tmp, "short"), threshold=10) << iter(range(25))
+assert s.spilled == 0
+try:
+    s[30]
+except IndexError:
+    pass
+else:
+    assert False, "IndexError expected"
+assert s.spilled == 20 and list(s) == list(range(25))
+s.close()
+
+s = SpillStream(os.path.join(tmp, "chunked"), threshold=10, chunk=4) << iter(range(25))
+assert list(s) == list(range(25))
+s.close()
+
+with open(os.path.join(tmp, "chunked.idx"), "ab") as index:
+    index.write(b"\0\0\0") # torn write
+s = SpillStream(os.path.join(tmp, "chunked"), threshold=10) << iter(range(25, 40))
+assert s.spilled == 25
+assert s[35] == 35 and s.spilled == 35
+s.close()
+s = SpillStream(os.path.join(tmp, "chunked"), threshold=10)
+try:
+    len(s)
+except TypeError:
+    pass
+else:
+    assert False, "length is not known"
+assert s.spilled == 36 and list(s) == list(range(36))
+assert len(s) == 36 and s[-1] == 35 and s[-36] == 0
+s.close()
+
+shutil.rmtree(tmp)
+
+#----------------------------------    
+# Sized sources
+#----------------------------------    
+s = Stream() << range(10**12) << [1, 2]
+assert len(s) == 10**12 + 2
+assert s[10**11] == 10**11
+assert s[-1] == 2 and s[-3] == 10**12 - 1
+assert s.take_chunk(10**12 - 1, 5) == [10**12 - 1, 1, 2]
+assert list(s[-4:]) == [10**12 - 2, 10**12 - 1, 1, 2]
+assert len(s._collection) == 0
+
+s = Stream() << [1] << iter([2, 3]) << (4, 5)
+try:
+    len(s)
+except TypeError:
+    pass
+else:
+    assert False, "length is not known"
+assert list(s) == [1,2,3,4,5]
+assert len(s) == 5 and s[-1] == 5
+assert len(s._collection) == 4
+
+#----------------------------------    
+# Parallel map
+#----------------------------------    
+s = Stream() << count()
+squares = s.tmap(lambda x: x * x, workers=4, prefetch=8)
+assert list(take(5, squares)) == [0,1,4,9,16]
+assert s._filled() <= 5 + 8 # bounded read-ahead
+del squares # pool is terminated now, not at interpreter shutdown
+
+if __name__ == "__main__":
+    s = Stream() << count(0, -1)
+    assert list(take(100, s.pmap(abs, workers=2, prefetch=4))) == list(range(100))
+
+#----------------------------------    
+# Background read-ahead
+#----------------------------------    
+import gc, time
+
+pulled = []
+def lines():
+    for n in count():
+        time.sleep(0.001) # slow I/O
+        pulled.append(n)
+        yield n
+
+s = (Stream() << lines).readahead(10)
+assert list(take(3, s)) == [0,1,2]
+while not s._sources[0]._queue.full(): time.sleep(0.001)
+assert 3 + 10 <= len(pulled) <= 3 + 10 + 1 # queue is full, producer waits
+
+thread = s._sources[0]._thread
+del s; gc.collect()
+thread.join(1)
+assert not thread.is_alive()
+
+def broken():
+    yield 1
+    raise ValueError("broken source")
+
+s = (Stream() << broken).readahead()
+try:
+    list(s)
+except ValueError:
+    pass
+else:
+    assert False, "ValueError expected"
+assert list(s) == [1]
+
+#----------------------------------    
+# Instrumentation
+#----------------------------------    
+pulled = []
+s = (Stream() << [0] << iter(range(1, 10))).instrument(lambda i, n: pulled.append((i, n)))
+assert list(s) == list(range(10))
+assert list(s) == list(range(10))
+assert s[5] == 5
+assert pulled == [(i, i) for i in range(1, 10)]
+assert s.stats.materialized == 9 and s.stats.peak == 9
+assert s.stats.pulls == 10 # the last one found origin exhausted
+assert s.stats.hits == 1 + 9 + 1 + 1 # head segment (twice), second pass, s[5]
+assert s.stats.calls == 10 + 10 + 1
+assert s.stats.origin_time > 0
+
+f = WindowedStream(chunk=8).instrument()
+fib = f << [0, 1] << map(add, f, drop(1, f))
+assert list(take(20, fib))[-1] == 4181
+assert f.stats.pulls == 3 and f.stats.materialized == 24
+assert f.stats.peak <= 8 + 2
+
+pulled = []
+t = TypedStream("l", chunk=100).instrument(lambda i, n: pulled.append(n))
+t << iter(range(250))
+assert sum(t) == sum(range(250)) and pulled == list(range(250))
+assert t.stats.pulls == 4 and t.stats.materialized == 250 and t.stats.peak == 250
+
+#----------------------------------    
+# Many small sources
+#----------------------------------    
+s = Stream()
+for i in range(0, 100000, 10):
+    s << iter(range(i, i + 10))
+assert sum(s) == sum(range(100000))
+
+s = Stream() << iter([1, 2])
+assert list(s) == [1,2]
+s << iter([3]) << (4, 5) # exhausted origin is restarted
+assert list(s) == [1,2,3,4,5]
+
+#----------------------------------    
+# Lines of file
+#----------------------------------    
+tmp = tempfile.mkdtemp()
+path = os.path.join(tmp, "log")
+with open(path, "wb") as f:
+    f.write("".join("line %d\n" % i for i in range(1000)).encode() + b"tail")
+
+s = Stream.from_file(path)
+assert s[10] == b"line 10\n"
+assert s._filled() == 11
+assert bytes(s[5:8]) == b"line 5\nline 6\nline 7\n"
+assert list(take(2, s[998:])) == [b"line 998\n", b"line 999\n"]
+assert list(s[0:30:10]) == [b"line 0\n", b"line 10\n", b"line 20\n"]
+try:
+    s[0:30:0]
+except ValueError:
+    pass
+else:
+    assert False, "ValueError expected"
+assert s[-1] == b"tail" and len(s) == 1001
+assert list(s[2::-1]) == [b"line 2\n", b"line 1\n", b"line 0\n"]
+assert s.take_chunk(999, 5) == [b"line 999\n", b"tail"]
+view = s[5:6]
+s.close() # file is closed even with slice alive
+assert s._file.closed and bytes(view) == b"line 5\n"
+view.release()
+
+s = Stream.from_file(path)
+assert s._filled() == 1001 # index is reused
+assert s[500] == b"line 500\n"
+s.close()
+
+with open(path, "ab") as f:
+    f.write(b"\nmore")
+s = Stream.from_file(path)
+assert s._filled() == 0 # file is changed
+assert list(s)[-2:] == [b"tail\n", b"more"]
+s.close()
+
+os.remove(path + ".lines")
+s = Stream.from_file(path, chunk=100).instrument()
+assert sum(1 for line in s) == 1002
+assert s.stats.pulls == 11 and s.stats.materialized == 1002
+s.close()
+
+shutil.rmtree(tmp)
+
+#----------------------------------    
+# Merge of sorted streams
+#----------------------------------    
+s = Stream.merge(Stream() << count(0, 2), Stream() << count(0, 3), [1, 4, 4])
+assert list(take(10, s)) == [0,0,1,2,3,4,4,4,6,6]
+
+s = Stream.merge(count(0, 2), count(0, 3), count(0, 5), unique=True)
+assert list(take(10, s)) == [0,2,3,4,5,6,8,9,10,12]
+
+words = Stream.merge(["b", "dd"], ["a", "ccc"], key=len)
+assert list(words) == ["b", "a", "dd", "ccc"]
+
+h = Stream()
+hamming = h << [1] << Stream.merge(*[map(lambda x, p=p: p * x, h) for p in (2, 3, 5)], unique=True)
+assert list(take(15, hamming)) == [1,2,3,4,5,6,8,9,10,12,15,16,18,20,24]
+assert hamming[1690] == 2125764000
+
+users = [(1, "bob"), (2, "alice"), (4, "eve")]
+orders = [(1, "book"), (1, "pen"), (3, "cup"), (4, "tea")]
+joined = Stream.join(users, orders, key=lambda r: r[0])
+assert [(u[1], o[1]) for u, o in joined] == [("bob","book"),("bob","pen"),("eve","tea")]
+assert list(take(3, Stream.join(count(0, 2), count(0, 3), count(0, 5)))) == [(0,0,0),(30,30,30),(60,60,60)]
@@ -0,0 +1,211 @@
+############################################
+## Topic:
+## Lazy evaluation and declarative approach
+##
+## Author:
+## Alexey Kachayev, <kachayev@gmail.com>
+##
+## Link:
+## https://github.com/kachayev/talks/blob/master/master/kharkivpy%236/code/stream_async.py
+##
+## asyncio version of Stream from stream_33.py
+## P.S. Python 3.7+
+############################################
+
+import asyncio
+from operator import add
+from collections import deque
+
+# shortcuts
+async def amap(fn, *iterables):
+    iterators = [it.__aiter__() for it in iterables]
+    while True:
+        try:
+            args = [await it.__anext__() for it in iterators]
+        except StopAsyncIteration:
+            return
+        yield fn(*args)
+
+async def aislice(iterable, start, stop=None, step=1):
+    # stop is checked before awaiting next element: origin could be
+    # idle for a long time after the last wanted one
+    if stop is not None and start >= stop: return
+    position, wanted = 0, start
+    async for n in iterable:
+        if position == wanted:
+            yield n
+            wanted += step
+            if stop is not None and wanted >= stop: return
+        position += 1
+
+async def atake(limit, base):
+    return [n async for n in aislice(base, 0, limit)]
+
+async def _from_iterable(iterable):
+    for n in iterable: yield n
+
+class AsyncStream:
+
+    __slots__ = ("_collection", "_origin", "_lock")
+
+    class _StreamIterator:
+
+        __slots__ = ("_stream", "_position")
+
+        def __init__(self, stream):
+            self._stream = stream
+            self._position = -1 # not started yet
+
+        def __aiter__(self):
+            return self
+
+        async def __anext__(self):
+            # same as for sync version, but waiting for origin
+            # doesn't block other tasks
+            self._position += 1
+            collection = self._stream._collection
+            if self._position < len(collection) or await self._stream._fill_to(self._position):
+                return collection[self._position]
+
+            raise StopAsyncIteration()
+
+    def __init__(self):
+        self._collection = []
+        self._origin = deque() # sources that are not drained yet
+        self._lock = None # created lazily inside of running loop
+
+    def __lshift__(self, rvalue):
+        iterator = rvalue() if callable(rvalue) else rvalue
+        if not hasattr(iterator, "__aiter__"):
+            iterator = _from_iterable(iterator)
+        self._origin.append(iterator.__aiter__())
+        return self
+
+    async def _fill_to(self, index):
+        if len(self._collection) > index:
+            return True
+
+        # only one task at a time pulls from origin
+        if self._lock is None: self._lock = asyncio.Lock()
+        async with self._lock:
+            while len(self._collection) <= index and self._origin:
+                try:
+                    self._collection.append(await self._origin[0].__anext__())
+                except StopAsyncIteration:
+                    self._origin.popleft()
+
+        return len(self._collection) > index
+
+    def __aiter__(self):
+        return AsyncStream._StreamIterator(self)
+
+    async def _get(self, index):
+        if await self._fill_to(index):
+            return self._collection[index]
+        raise IndexError("Stream index out of range")
+
+    def __getitem__(self, index):
+        if isinstance(index, int):
+            if index < 0: raise TypeError("Invalid argument type")
+            return self._get(index)
+        elif isinstance(index, slice):
+            low, high, step = index.start or 0, index.stop, 1 if index.step is None else index.step
+            if step == 0: raise ValueError("slice step cannot be zero")
+            if step < 0: raise TypeError("Async stream could be sliced only forward")
+            if low < 0 or (high is not None and high < 0):
+                raise TypeError("Invalid argument type")
+            return AsyncStream() << aislice(self, low, high, step)
+        else:
+            raise TypeError("Invalid argument type")
+
+    def __await__(self):
+        # whole (finite!) stream as list, useful for slices
+        return atake(None, self).__await__()
+
+#----------------------------------
+# Simple cases
+#----------------------------------
+
+async def gen():
+    for n in (1, 2, 3):
+        await asyncio.sleep(0)
+        yield n
+
+async def simple():
+    s = AsyncStream() << gen << (4, 5)
+    assert await s == [1,2,3,4,5]
+    assert await s[1] == 2
+    assert await s[0:2] == [1,2]
+
+    s = AsyncStream() << gen
+    try:
+        await s[3]
+    except IndexError:
+        pass
+    else:
+        assert False, "IndexError expected"
+
+    try:
+        s[1:2:0]
+    except ValueError:
+        pass
+    else:
+        assert False, "ValueError expected"
+
+    try:
+        s[::-1]
+    except TypeError:
+        pass
+    else:
+        assert False, "TypeError expected"
+
+asyncio.run(simple())
+
+#----------------------------------
+# Fibonacci infinite sequence
+#----------------------------------
+
+async def fibonacci():
+    f = AsyncStream()
+    fib = f << [0, 1] << amap(add, f, f[1:])
+
+    assert await atake(10, fib) == [0,1,1,2,3,5,8,13,21,34]
+    assert await fib[20] == 6765
+    assert await fib[30:35] == [832040,1346269,2178309,3524578,5702887]
+
+asyncio.run(fibonacci())
+
+#----------------------------------
+# Many cursors, one slow producer
+#----------------------------------
+
+async def cursors():
+    pulled = []
+    async def producer():
+        for n in range(100):
+            await asyncio.sleep(0)
+            pulled.append(n)
+            yield n
+
+    s = AsyncStream() << producer
+    results = await asyncio.gather(*[atake(None, s) for _ in range(5)])
+    assert results == [list(range(100))] * 5
+    assert pulled == list(range(100))
+
+asyncio.run(cursors())
+
+#----------------------------------
+# Slices over idle origin
+#----------------------------------
+
+async def idle():
+    async def producer():
+        for n in range(5): yield n
+        await asyncio.Event().wait() # nothing more, but not exhausted
+
+    s = AsyncStream() << producer
+    assert await asyncio.wait_for(atake(5, s), 1) == [0,1,2,3,4]
+    assert await asyncio.wait_for(s[1:5:2], 1) == [1,3]
+    assert await asyncio.wait_for(s[3:3], 1) == []
+
+asyncio.run(idle())